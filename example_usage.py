@@ -1,8 +1,22 @@
 # examples.py
 # Demonstrates key use cases of the OllamaChat library when pulled into a notebook or script.
 
+import asyncio
+import codecs
+import os
+import sys
+
+try:
+    import termios
+    import tty
+except ImportError:  # Windows: the interactive example falls back to input()
+    termios = None
+
 from ollama_chat import OllamaChat
 
+# Pause in typing (seconds) after which the text so far is sent speculatively
+SPECULATE_AFTER = 0.4
+
 
 def example_new_session():
     """
@@ -29,7 +43,7 @@ def example_load_and_resume():
         project_name='notebook-demo',
         visual_mode='plain'
     )
-    if chat.load_session("binary-search-deep-dive.json"):
+    if chat.load_session("binary-search-deep-dive.jsonl"):
         reply = chat.send("What’s the worst-case time complexity again?")
         print("AI:", reply)
 
@@ -42,7 +56,7 @@ def example_inject_context():
         project_name='notebook-demo',
         visual_mode='plain'
     )
-    chat.load_session("binary-search-deep-dive.json")
+    chat.load_session("binary-search-deep-dive.jsonl")
     # Add inline context
     chat.add_context(
         "Quick-Sort Note",
@@ -62,7 +76,7 @@ def example_search_and_extract():
         project_name='notebook-demo',
         visual_mode='plain'
     )
-    chat.load_session("binary-search-deep-dive.json")
+    chat.load_session("binary-search-deep-dive.jsonl")
     results = chat.search_messages("binary search")
     print("Search Results:", results)
 
@@ -78,7 +92,7 @@ def example_stats_and_history():
         project_name='notebook-demo',
         visual_mode='plain'
     )
-    chat.load_session("binary-search-deep-dive.json")
+    chat.load_session("binary-search-deep-dive.jsonl")
     stats = chat.get_session_stats()
     print("Session Stats:", stats)
     # Display last 5 messages in console
@@ -93,17 +107,20 @@ def example_export_markdown():
         project_name='notebook-demo',
         visual_mode='plain'
     )
-    chat.load_session("binary-search-deep-dive.json")
-    markdown = chat.to_markdown()
+    chat.load_session("binary-search-deep-dive.jsonl")
     output_path = "binary_search_session.md"
-    with open(output_path, "w") as f:
-        f.write(markdown)
+    chat.write_markdown(output_path)
     print(f"Exported conversation to {output_path}")
 
 
 def example_silent_batch():
     """
     Run batch queries in silent mode (no live output).
+
+    Queries are sent concurrently, so how many are generated at once is up to
+    the Ollama server. Set these before running `ollama serve`:
+      OLLAMA_NUM_PARALLEL       - parallel requests per loaded model
+      OLLAMA_MAX_LOADED_MODELS  - models kept in memory at the same time
     """
     chat = OllamaChat(
         project_name='batch-runs',
@@ -111,13 +128,86 @@ def example_silent_batch():
     )
     chat.start_new_session(session_name="batch-queries")
     queries = ["Explain PCA", "Give me pseudocode for k-means"]
-    answers = [chat.send(q) for q in queries]
+    answers = asyncio.run(chat.send_many(queries))
     print("Batch answers:", answers)
 
+    # Stateless fast path: no history is sent and nothing is saved
+    one_offs = ["Define variance in one sentence", "Define entropy in one sentence"]
+    print("One-off answers:", asyncio.run(chat.send_batch(one_offs)))
+
+
+async def read_line_speculatively(chat, prompt="You ▶ "):
+    """
+    Read one line from the terminal, answering it in the background while typing.
+
+    Whenever typing pauses, the text so far is sent with asend(commit=False);
+    any keystroke that changes the text cancels that request. If the line
+    submitted with Enter is the one being answered, its reply is reused and
+    committed to the history. Returns (line, reply); reply is None for
+    'quit'/'exit'.
+    """
+    loop = asyncio.get_running_loop()
+    keys = asyncio.Queue()
+    fd = sys.stdin.fileno()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    old_attrs = termios.tcgetattr(fd)
+
+    buffer = ""
+    task = None
+    task_text = None
+
+    tty.setcbreak(fd)
+    loop.add_reader(fd, lambda: keys.put_nowait(decoder.decode(os.read(fd, 1024))))
+    print(prompt, end='', flush=True)
+    try:
+        while True:
+            try:
+                typed = await asyncio.wait_for(keys.get(), SPECULATE_AFTER)
+            except asyncio.TimeoutError:
+                # Typing paused: start answering what is there so far
+                if buffer.strip() and task is None:
+                    task_text = buffer
+                    task = asyncio.create_task(chat.asend(buffer, commit=False))
+                continue
+
+            for char in typed:
+                if char in ('\r', '\n'):
+                    print()
+                    if buffer.lower() in ('quit', 'exit'):
+                        if task:
+                            task.cancel()
+                        return buffer, None
+                    if task is not None and task_text == buffer:
+                        reply = await task
+                        if reply is not None:
+                            chat.add_message('user', buffer)
+                            chat.add_message('assistant', reply)
+                        return buffer, reply
+                    return buffer, await chat.asend(buffer)
+                elif char in ('\x7f', '\b'):
+                    if buffer:
+                        buffer = buffer[:-1]
+                        print('\b \b', end='', flush=True)
+                elif char.isprintable():
+                    buffer += char
+                    print(char, end='', flush=True)
+
+            # The text changed, so any in-flight answer is stale
+            if task is not None and task_text != buffer:
+                task.cancel()
+                task = None
+    finally:
+        loop.remove_reader(fd)
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_attrs)
+
 
 def example_interactive_loop():
     """
-    Simple REPL loop driven by input(); type 'quit' to exit.
+    REPL loop that starts answering while you type; type 'quit' to exit.
+
+    Model prefill is hidden behind typing time: a reply is often ready, or
+    well under way, by the time Enter is pressed. Needs a POSIX terminal;
+    elsewhere it falls back to a plain input() loop.
     """
     chat = OllamaChat(
         project_name='notebook-demo',
@@ -125,12 +215,24 @@ def example_interactive_loop():
     )
     chat.start_new_session(session_name="interactive-loop")
     print("Starting interactive loop. Type 'quit' to exit.")
-    while True:
-        user_q = input("You ▶ ")
-        if user_q.lower() in ('quit', 'exit'):
-            break
-        ai_response = chat.send(user_q)
-        print(f"AI ▶ {ai_response}\n")
+
+    if termios is None or not sys.stdin.isatty():
+        while True:
+            user_q = input("You ▶ ")
+            if user_q.lower() in ('quit', 'exit'):
+                break
+            ai_response = chat.send(user_q)
+            print(f"AI ▶ {ai_response}\n")
+        return
+
+    async def run():
+        while True:
+            user_q, ai_response = await read_line_speculatively(chat)
+            if user_q.lower() in ('quit', 'exit'):
+                break
+            print(f"AI ▶ {ai_response}\n")
+
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
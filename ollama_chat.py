@@ -1,8 +1,21 @@
 import ollama
+import httpx
+import asyncio
+import bisect
+import hashlib
+import weakref
 import sys
 import os
 import json
 import re
+import sqlite3
+import threading
+import queue
+import atexit
+import functools
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Optional, Union
 import time
@@ -10,7 +23,7 @@ from transformers import AutoTokenizer
 
 # Rich library for enhanced console output
 try:
-    from rich.console import Console
+    from rich.console import Console, Group
     from rich.panel import Panel
     from rich.text import Text
     from rich.table import Table
@@ -25,7 +38,171 @@ except ImportError:
     RICH_AVAILABLE = False
     print("Note: Install 'rich' for enhanced visual experience: pip install rich")
 
+# orjson for faster JSONL session records (stdlib json otherwise)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# MessagePack for the optional binary session format
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
 CONVERSATIONS_DIR = "conversations"
+SESSION_EXT = ".jsonl"          # Append-only log: one JSON record per line
+MSGPACK_SESSION_EXT = ".msgpack"  # Same records, MessagePack-encoded back to back
+LEGACY_SESSION_EXT = ".json"    # Older single-document sessions (read/write compatible)
+SESSION_FILE_EXTS = (SESSION_EXT, MSGPACK_SESSION_EXT, LEGACY_SESSION_EXT)
+SUMMARY_INDEX_FILE = "session_summaries.index"  # Cached list_sessions() details, per project
+
+# Parsed sessions shared by all OllamaChat instances in the process:
+# abspath -> (mtime_ns, size, parsed data), least recently used first.
+SESSION_CACHE_SIZE = 8
+_SESSION_CACHE = OrderedDict()
+
+# add_file_context() limits
+MAX_CONTEXT_FILE_BYTES = 4 << 20  # Larger files are rejected
+BINARY_SNIFF_SIZE = 4096          # A NUL byte in this many leading bytes marks a file as binary
+CONTEXT_CHUNK_SIZE = 100_000      # Longer files become several context items (characters each)
+
+LEGACY_PEEK_SIZE = 4096  # Bytes read from each end of a legacy .json session when listing
+LEGACY_MESSAGES_KEY_RE = re.compile(r'"messages"\s*:\s*\[')
+LEGACY_DOCUMENT_END_RE = re.compile(r'\s*\]\s*\}\s*$')
+SUMMARY_WORKERS = 8  # Threads reading changed sessions in list_sessions(include_metadata=True)
+
+WRITE_BUFFER_SIZE = 1 << 20  # Session writes are coalesced into few large syscalls
+
+# Session appends are queued and written in batches, see OllamaChat.flush()
+FLUSH_DELAY = 0.05       # Seconds without new records before the queue is written
+FLUSH_BATCH_SIZE = 32    # Queue length that triggers an immediate write
+
+TOKENIZER_NAME = "deepseek-ai/DeepSeek-R1"  # Used by OllamaChat.token_counts()
+
+# Approximate prompt tokens per send_batch() call above which a warning is printed
+BATCH_TOKEN_BUDGET = 32768
+CHARS_PER_TOKEN = 4  # Rough estimate, avoids loading a tokenizer
+
+PRINT_FLUSH_INTERVAL = 0.016  # Max seconds streamed text sits unflushed while more is queued
+RICH_FRAME_INTERVAL = 1 / 30  # Streamed text is passed to rich at most this often
+
+# Joins message contents into one string for the in-memory search fallback
+SEARCH_SEPARATOR = "\x1f"
+
+# Fenced code blocks are ```lang\n...```; see extract_code_blocks()
+CODE_FENCE = '```'
+CODE_LANGUAGE_RE = re.compile(r'\w*')
+
+VALID_ROLES = frozenset(('user', 'assistant', 'system'))
+
+# Per-role display settings shared by console output and markdown export
+ROLE_EMOJI = {'user': '👤', 'assistant': '🤖', 'system': '🔧'}
+ROLE_COLORS = {'user': 'blue', 'assistant': 'green', 'system': 'yellow'}
+ROLE_TITLES = {role: role.title() for role in VALID_ROLES}
+
+SEARCH_INDEX_FILE = "search_index.sqlite3"  # Per-project FTS5 index of all messages
+SEARCH_INDEX_VERSION = 2  # Stored as PRAGMA user_version; older indexes are rebuilt
+MIN_INDEXED_QUERY = 3     # Trigram index needs at least this many characters; shorter queries scan
+
+# Run before SEARCH_INDEX_SCHEMA when the stored version is older
+SEARCH_INDEX_RESET = """
+DROP TRIGGER IF EXISTS chat_messages_ai;
+DROP TRIGGER IF EXISTS chat_messages_ad;
+DROP TRIGGER IF EXISTS chat_messages_au;
+DROP TABLE IF EXISTS chat_messages_fts;
+DROP TABLE IF EXISTS chat_messages;
+"""
+
+SEARCH_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_messages(
+    id INTEGER PRIMARY KEY,
+    session TEXT,
+    idx INTEGER,
+    role TEXT,
+    content TEXT,
+    ts REAL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_session ON chat_messages(session, idx);
+CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+    content, content=chat_messages, content_rowid=id,
+    tokenize="trigram"
+);
+CREATE TRIGGER IF NOT EXISTS chat_messages_ai AFTER INSERT ON chat_messages BEGIN
+    INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_messages_ad AFTER DELETE ON chat_messages BEGIN
+    INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_messages_au AFTER UPDATE ON chat_messages BEGIN
+    INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+# The sync HTTP client is shared by every OllamaChat so keep-alive connections
+# are reused; async methods open one AsyncClient per call, as its pooled
+# connections are bound to the event loop. The server address comes from
+# OLLAMA_HOST, as with the ollama package itself.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_client = None
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tokenizer():
+    """Load the DeepSeek-R1 tokenizer once per process."""
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+
+
+@functools.lru_cache(maxsize=4096)
+def _count_tokens(text):
+    """Token count for one string; repeated texts (system prompts, context) hit the cache."""
+    return len(_get_tokenizer().encode(text, add_special_tokens=False))
+
+
+_open_chats = weakref.WeakSet()  # Instances whose queued records are flushed at exit
+
+
+@atexit.register
+def _flush_open_chats():
+    """Write every instance's queued session records before the interpreter exits."""
+    for chat in list(_open_chats):
+        chat.flush()
+
+
+def _get_client():
+    """Return the process-wide ollama.Client."""
+    global _client
+    if _client is None:
+        _client = ollama.Client(timeout=None, limits=HTTP_LIMITS)
+    return _client
+
+
+class _HistoryWithPrompt(Sequence):
+    """Read-only view of a history tuple followed by one more message, without copying it."""
+
+    __slots__ = ('prefix', 'last')
+
+    def __init__(self, prefix, last):
+        self.prefix = prefix
+        self.last = last
+
+    def __len__(self):
+        return len(self.prefix) + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index == len(self.prefix):
+            return self.last
+        if not 0 <= index < len(self.prefix):
+            raise IndexError(index)
+        return self.prefix[index]
+
 
 class OllamaChat:
     """
@@ -34,7 +211,7 @@ class OllamaChat:
     """
 
     def __init__(self, model='deepseek-r1:7b', conversations_dir=CONVERSATIONS_DIR, 
-                 visual_mode='auto', project_name=None):
+                 visual_mode='auto', project_name=None, session_format='jsonl'):
         """
         Initialize the enhanced chat manager.
 
@@ -43,6 +220,7 @@ class OllamaChat:
             conversations_dir (str): Directory to store chat files
             visual_mode (str): 'auto', 'rich', 'plain', 'silent'
             project_name (str): Optional project name for session organization
+            session_format (str): 'jsonl' or 'msgpack' for new sessions
         """
         self.model = model
         self.conversations_dir = conversations_dir
@@ -50,6 +228,19 @@ class OllamaChat:
         self.filepath = None
         self.project_name = project_name
         self.context_data = []
+        self.last_usage = None
+        self._persisted_count = 0  # Messages already written to the session file
+        self._context_refs = {}    # Message index -> hash of the context it holds
+        self._stats = {}           # Running message counts, see _recount_stats()
+        self._ctx_tokens = None    # Server context tokens for the history, see _open_stream()
+        self._search_blob = None   # (joined contents, start offsets), see _get_search_blob()
+        self._pending = []         # Records queued for the session file, see flush()
+        self._flush_timer = None
+        self._pending_guard = None  # Writes _pending if the instance is collected first, see _guard_pending()
+        self._flush_lock = threading.RLock()
+        _open_chats.add(self)
+        self._recount_stats()
+        self._search_db = None     # sqlite3 connection, or False if FTS5 is unavailable
         
         # Visual mode setup
         self.visual_mode = visual_mode
@@ -58,10 +249,73 @@ class OllamaChat:
         
         self.console = Console() if RICH_AVAILABLE and self.visual_mode == 'rich' else None
         self._ensure_conversations_dir()
+
+        # Session file format for new sessions
+        self.session_ext = SESSION_EXT
+        if session_format == 'msgpack':
+            if MSGPACK_AVAILABLE:
+                self.session_ext = MSGPACK_SESSION_EXT
+            else:
+                self._print_error("msgpack is not installed (pip install msgpack); using JSONL")
         
         if self.visual_mode != 'silent':
             self._print_welcome()
 
+    def _start_printer(self):
+        """Start a printer thread for one streamed reply; returns (queue, thread, errors)."""
+        parts, errors = queue.Queue(), []
+        thread = threading.Thread(target=self._printer, args=(parts, self.console, errors), daemon=True)
+        thread.start()
+        return parts, thread, errors
+
+    def _finish_stream(self, printer):
+        """Stop a printer once its queue is written, end the line, and return any write error."""
+        if printer is None:
+            return None
+        parts, thread, errors = printer
+        parts.put(None)
+        thread.join()
+        print()  # Newline after streaming
+        return errors[0] if errors else None
+
+    @staticmethod
+    def _printer(parts, console, errors):
+        """Write streamed text from the queue in batches until a None part arrives."""
+        last_flush = time.monotonic()
+        done = False
+        while not done:
+            batch = [parts.get()]
+            if batch[0] is None:
+                break
+            if console:
+                deadline = time.monotonic() + RICH_FRAME_INTERVAL
+                while '\n' not in batch[-1]:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        part = parts.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if part is None:
+                        done = True
+                        break
+                    batch.append(part)
+            if errors:
+                continue
+            try:
+                if console:
+                    console.print(''.join(batch), end='', style="green",
+                                  soft_wrap=True, highlight=False, markup=False)
+                else:
+                    sys.stdout.write(batch[0])
+                    now = time.monotonic()
+                    if '\n' in batch[0] or parts.empty() or now - last_flush >= PRINT_FLUSH_INTERVAL:
+                        sys.stdout.flush()
+                        last_flush = now
+            except Exception as e:
+                errors.append(e)
+
     def _print_welcome(self):
         """Print welcome message based on visual mode."""
         if self.console:
@@ -69,7 +323,7 @@ class OllamaChat:
                 f"[bold green]🤖 OllamaChat Enhanced v2.0[/bold green]\n"
                 f"[blue]Model:[/blue] {self.model}\n"
                 f"[yellow]Project:[/yellow] {self.project_name or 'Default'}\n"
-                f"[cyan]Sessions:[/cyan] {len(self.list_sessions())}",
+                f"[cyan]Sessions:[/cyan] {len(self._session_entries())}",
                 title="[bold]Welcome[/bold]",
                 border_style="green"
             )
@@ -82,24 +336,104 @@ class OllamaChat:
     def _ensure_conversations_dir(self):
         """Ensure conversation storage directory exists."""
         project_dir = os.path.join(self.conversations_dir, self.project_name or 'default')
-        if not os.path.exists(project_dir):
-            os.makedirs(project_dir, exist_ok=True)
+        os.makedirs(project_dir, exist_ok=True)
         self.project_dir = project_dir
 
     def _generate_filepath(self, custom_name=None):
         """Generate filepath for new session."""
         if custom_name:
-            filename = f"{custom_name}.json"
+            filename = f"{custom_name}{self.session_ext}"
         else:
             now = datetime.now()
-            filename = f"{now.strftime('%Y%m%d_%H%M%S')}.json"
+            filename = f"{now.strftime('%Y%m%d_%H%M%S')}{self.session_ext}"
         return os.path.join(self.project_dir, filename)
 
+    def _is_legacy_session(self, filepath=None):
+        """Check whether a session file uses the old single-document JSON format."""
+        return (filepath or self.filepath).endswith(LEGACY_SESSION_EXT)
+
+    def _session_records(self):
+        """Yield every record needed to rebuild the current session as JSONL."""
+        yield {
+            "type": "session_metadata",
+            "model": self.model,
+            "project": self.project_name,
+            "created": getattr(self, 'created_time', datetime.now().isoformat())
+        }
+        for item in self.context_data:
+            yield {"type": "context", "context": item}
+        for i, msg in enumerate(self.messages):
+            yield self._message_record(i, msg)
+
+    @staticmethod
+    def _dumps_record(record):
+        """Encode one record as a newline-terminated JSONL line (bytes)."""
+        if ORJSON_AVAILABLE:
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    @staticmethod
+    def _loads_record(line):
+        """Decode one JSONL line, or a whole legacy JSON document (bytes)."""
+        if ORJSON_AVAILABLE:
+            return orjson.loads(line)
+        return json.loads(line)
+
+    @staticmethod
+    def _serialize(record):
+        """Encode one record for a MessagePack session file."""
+        return msgpack.packb(record, use_bin_type=True)
+
+    @staticmethod
+    def _deserialize(data):
+        """Decode one MessagePack-encoded record."""
+        return msgpack.unpackb(data, raw=False)
+
+    @staticmethod
+    def _write_records(filepath, records, mode='a'):
+        """Write records to a session file in its format ('w' replaces, 'a' appends)."""
+        with open(filepath, mode + 'b', buffering=WRITE_BUFFER_SIZE) as f:
+            if filepath.endswith(MSGPACK_SESSION_EXT):
+                for record in records:
+                    f.write(OllamaChat._serialize(record))
+            else:
+                for record in records:
+                    f.write(OllamaChat._dumps_record(record))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _message_record(self, index, message):
+        """Build the record for the message at the given index."""
+        ref = self._context_refs.get(index)
+        if ref is not None:
+            return {"type": "message", "id": index + 1, "role": message['role'], "context_ref": ref}
+        return {"type": "message", "id": index + 1, **message}
+
+    @staticmethod
+    def _content_hash(content):
+        """Hash identifying a context's content."""
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _context_message(context_item):
+        """System message text injected for a context item."""
+        return f"Context - {context_item['title']}:\n{context_item['content']}"
+
     def _save(self):
-        """Save current conversation with metadata."""
+        """Write the whole session file (new sessions and legacy JSON sessions)."""
         if not self.filepath:
             return
 
+        if not self._is_legacy_session():
+            try:
+                self._write_records(self.filepath, self._session_records(), mode='w')
+                self._invalidate_cache()
+                self._persisted_count = len(self.messages)
+                self._reindex_session()
+            except IOError as e:
+                self._print_error(f"Could not save conversation: {e}")
+            return
+
         metadata = {
             "model": self.model,
             "project": self.project_name,
@@ -115,32 +449,316 @@ class OllamaChat:
         }
         
         try:
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, indent=2, ensure_ascii=False)
+            # Encode in one go and write once; json.dump would push many small
+            # iterencode chunks through write(), and indentation doubles the size
+            if ORJSON_AVAILABLE:
+                payload = orjson.dumps(data_to_save)
+            else:
+                payload = json.dumps(data_to_save, ensure_ascii=False).encode('utf-8')
+            with open(self.filepath, 'wb') as f:
+                f.write(payload)
+            self._invalidate_cache()
+            self._persisted_count = len(self.messages)
         except IOError as e:
             self._print_error(f"Could not save conversation: {e}")
 
+    def _persist(self, extra_records=(), defer=False):
+        """Queue messages added since the last save (legacy sessions are converted or rewritten)."""
+        if not self.filepath:
+            return
+
+        start = self._persisted_count
+        if self._is_legacy_session():
+            if not self._migrate_legacy_session():
+                self._save()
+                self._index_messages(range(start, self._persisted_count))
+            return
+
+        records = list(extra_records)
+        for i in range(start, len(self.messages)):
+            records.append(self._message_record(i, self.messages[i]))
+        if not records:
+            return
+
+        self._persisted_count = len(self.messages)
+        with self._flush_lock:
+            if not self._pending:
+                self._guard_pending()
+            self._pending.extend(records)
+            if len(self._pending) >= FLUSH_BATCH_SIZE:
+                self.flush()
+                return
+            if defer:
+                return
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _migrate_legacy_session(self):
+        """Rewrite the current legacy .json session as .jsonl; False if that is not possible."""
+        legacy_path = self.filepath
+        jsonl_path = os.path.splitext(legacy_path)[0] + SESSION_EXT
+        if os.path.exists(jsonl_path):
+            return False
+
+        self.filepath = jsonl_path
+        try:
+            self._write_records(self.filepath, self._session_records(), mode='w')
+        except IOError as e:
+            self._print_error(f"Could not convert {os.path.basename(legacy_path)} to JSONL: {e}")
+            self.filepath = legacy_path
+            return False
+
+        try:
+            os.remove(legacy_path)
+        except OSError as e:
+            self._print_error(f"Could not remove {os.path.basename(legacy_path)}: {e}")
+        self._invalidate_cache(legacy_path)
+        self._invalidate_cache()
+        self._persisted_count = len(self.messages)
+
+        db = self._get_search_index()
+        if db:
+            try:
+                with db:
+                    db.execute("DELETE FROM chat_messages WHERE session = ?", (os.path.basename(legacy_path),))
+            except sqlite3.Error as e:
+                self._print_error(f"Could not update search index: {e}")
+        self._reindex_session()
+        return True
+
+    def flush(self):
+        """
+        Append queued records to the session file now (and fsync it).
+
+        Runs automatically at the end of each send, once writes go quiet for
+        FLUSH_DELAY seconds, when FLUSH_BATCH_SIZE records are queued, before
+        switching sessions, and at interpreter exit. Records that fail to
+        write stay queued.
+        """
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            records, self._pending = self._pending, []
+            if self._pending_guard is not None:
+                self._pending_guard.detach()
+                self._pending_guard = None
+            if not records or not self.filepath:
+                return
+
+            try:
+                self._write_records(self.filepath, records)
+                self._invalidate_cache()
+            except IOError as e:
+                self._pending = records + self._pending
+                self._guard_pending()
+                self._print_error(f"Could not save conversation: {e}")
+                return
+
+            # Messages dropped from the history since they were queued stay unindexed
+            self._index_messages(r['id'] - 1 for r in records
+                                 if r['type'] == 'message' and r['id'] <= len(self.messages))
+
+    def _guard_pending(self):
+        """Write the queued records if the instance is garbage collected before flush()."""
+        self._pending_guard = weakref.finalize(self, self._write_records, self.filepath, self._pending)
+        self._pending_guard.atexit = False
+
+    def _iter_records(self, filepath):
+        """Yield the records of a JSONL or MessagePack session file."""
+        with open(filepath, 'rb') as f:
+            first_byte = f.read(1)
+            f.seek(0)
+            if first_byte == b'{' or not first_byte:
+                for line in f:
+                    if line.strip():
+                        yield self._loads_record(line)
+            else:
+                if not MSGPACK_AVAILABLE:
+                    raise RuntimeError("session is MessagePack-encoded; install msgpack to read it")
+                yield from msgpack.Unpacker(f, raw=False)
+
+    def _read_session(self, filepath):
+        """Read a session file of any supported format into a legacy-shaped dict."""
+        if self._is_legacy_session(filepath):
+            with open(filepath, 'rb') as f:
+                return self._loads_record(f.read())
+
+        metadata = {}
+        messages = []
+        context_data = []
+        contexts_by_hash = {}
+        context_refs = {}
+        for record in self._iter_records(filepath):
+            record_type = record.pop('type', 'message')
+            if record_type == 'message':
+                record.pop('id', None)
+                ref = record.pop('context_ref', None)
+                if ref is not None:
+                    record['content'] = self._context_message(contexts_by_hash[ref])
+                    context_refs[len(messages)] = ref
+                messages.append(record)
+            elif record_type == 'message_update':
+                messages[record.pop('id') - 1].update(record)
+            elif record_type == 'context':
+                context_data.append(record['context'])
+                if 'hash' in record['context']:
+                    contexts_by_hash[record['context']['hash']] = record['context']
+            elif record_type == 'session_metadata':
+                metadata.update(record)
+
+        metadata['last_modified'] = datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat()
+        metadata['message_count'] = len(messages)
+        metadata['context_data'] = context_data
+        return {'metadata': metadata, 'messages': messages, 'context_refs': context_refs}
+
+    def _load_raw(self, filepath):
+        """Read a session file, reusing the cached parse while the file is unchanged."""
+        st = os.stat(filepath)
+        key = os.path.abspath(filepath)
+        cached = _SESSION_CACHE.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            _SESSION_CACHE.move_to_end(key)
+            data = cached[2]
+        else:
+            data = self._read_session(filepath)
+            _SESSION_CACHE[key] = (st.st_mtime_ns, st.st_size, data)
+            while len(_SESSION_CACHE) > SESSION_CACHE_SIZE:
+                _SESSION_CACHE.popitem(last=False)
+
+        metadata = dict(data.get('metadata', {}))
+        metadata['context_data'] = list(metadata.get('context_data', []))
+        return {
+            'metadata': metadata,
+            'messages': [dict(m) for m in data.get('messages', [])],
+            'context_refs': dict(data.get('context_refs', {}))
+        }
+
+    def _invalidate_cache(self, filepath=None):
+        """Drop a session's cached parse after writing to it."""
+        _SESSION_CACHE.pop(os.path.abspath(filepath or self.filepath), None)
+
+    # Search index
+
+    def _get_search_index(self):
+        """Open the project's SQLite full-text index, creating it on first use (None if unavailable)."""
+        if self._search_db is None:
+            db_path = os.path.join(self.project_dir, SEARCH_INDEX_FILE)
+            try:
+                db = sqlite3.connect(db_path, check_same_thread=False)
+                is_new = db.execute("PRAGMA user_version").fetchone()[0] < SEARCH_INDEX_VERSION
+                with db:
+                    if is_new:
+                        db.executescript(SEARCH_INDEX_RESET)
+                    db.executescript(SEARCH_INDEX_SCHEMA)
+                    db.execute(f"PRAGMA user_version = {SEARCH_INDEX_VERSION}")
+            except sqlite3.Error:
+                self._search_db = False
+                return None
+
+            self._search_db = db
+            if is_new:
+                self._backfill_search_index()
+
+        return self._search_db or None
+
+    def _close_search_index(self):
+        """Close the search index connection (e.g. when switching projects)."""
+        if self._search_db:
+            self._search_db.close()
+        self._search_db = None
+
+    def _backfill_search_index(self):
+        """Index every session file in the project (run when the index is created or rebuilt)."""
+        db = self._search_db
+        for entry in self._session_entries():
+            filename = entry.name
+            try:
+                messages = self._read_session(entry.path).get('messages', [])
+            except Exception:
+                continue
+            with db:
+                db.executemany(
+                    "INSERT INTO chat_messages(session, idx, role, content, ts) VALUES (?, ?, ?, ?, ?)",
+                    [(filename, i, m['role'], m['content'], time.time()) for i, m in enumerate(messages)]
+                )
+
+    def _index_messages(self, indices):
+        """Add the messages at the given indices to the search index."""
+        db = self._get_search_index()
+        if not db or not self.filepath:
+            return
+
+        session = os.path.basename(self.filepath)
+        now = time.time()
+        try:
+            with db:
+                db.executemany(
+                    "INSERT INTO chat_messages(session, idx, role, content, ts) VALUES (?, ?, ?, ?, ?)",
+                    [(session, i, self.messages[i]['role'], self.messages[i]['content'], now)
+                     for i in indices]
+                )
+        except sqlite3.Error as e:
+            self._print_error(f"Could not update search index: {e}")
+
+    def _reindex_session(self):
+        """Replace the current session's rows in the search index."""
+        db = self._get_search_index()
+        if not db or not self.filepath:
+            return
+
+        try:
+            with db:
+                db.execute("DELETE FROM chat_messages WHERE session = ?", (os.path.basename(self.filepath),))
+        except sqlite3.Error as e:
+            self._print_error(f"Could not update search index: {e}")
+            return
+        self._index_messages(range(self._persisted_count))
+
+    def _sync_search_index(self):
+        """Reindex the loaded session if the index is missing some of its messages."""
+        db = self._get_search_index()
+        if not db or not self.filepath:
+            return
+
+        try:
+            (indexed,) = db.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE session = ?",
+                (os.path.basename(self.filepath),)
+            ).fetchone()
+        except sqlite3.Error:
+            return
+        if indexed != self._persisted_count:
+            self._reindex_session()
+
     def _print_message(self, role, content, stream=False):
         """Print message with appropriate formatting."""
         if self.visual_mode == 'silent':
             return
             
         if self.console:
-            colors = {'user': 'blue', 'assistant': 'green', 'system': 'yellow'}
-            icons = {'user': '👤', 'assistant': '🤖', 'system': '🔧'}
-            
             if not stream:
-                panel = Panel(
-                    content,
-                    title=f"[bold]{icons.get(role, '•')} {role.title()}[/bold]",
-                    border_style=colors.get(role, 'white'),
-                    title_align="left"
-                )
-                self.console.print(panel)
+                self.console.print(self._message_panel(role, content))
             else:
-                self.console.print(f"[{colors.get(role, 'white')}]{icons.get(role, '•')} {role.title()}:[/{colors.get(role, 'white')}] ", end="")
+                color = ROLE_COLORS.get(role, 'white')
+                title = ROLE_TITLES.get(role) or role.title()
+                self.console.print(f"[{color}]{ROLE_EMOJI.get(role, '•')} {title}:[/{color}] ", end="")
         else:
-            print(f"\n{role.title()}: {content}")
+            print(f"\n{ROLE_TITLES.get(role) or role.title()}: {content}")
+
+    @staticmethod
+    def _message_panel(role, content):
+        """Build the rich panel showing one message."""
+        title = ROLE_TITLES.get(role) or role.title()
+        return Panel(
+            content,
+            title=f"[bold]{ROLE_EMOJI.get(role, '•')} {title}[/bold]",
+            border_style=ROLE_COLORS.get(role, 'white'),
+            title_align="left"
+        )
 
     def _print_error(self, message):
         """Print error message."""
@@ -152,6 +770,16 @@ class OllamaChat:
         else:
             print(f"[Error] {message}")
 
+    def _print_warning(self, message):
+        """Print warning message."""
+        if self.visual_mode == 'silent':
+            return
+
+        if self.console:
+            self.console.print(f"[bold yellow]⚠️ Warning:[/bold yellow] {message}")
+        else:
+            print(f"[Warning] {message}")
+
     def _print_success(self, message):
         """Print success message."""
         if self.visual_mode == 'silent':
@@ -164,33 +792,182 @@ class OllamaChat:
 
     # Core functionality (enhanced versions of your original methods)
     
+    def _session_entries(self):
+        """Return a DirEntry for each session file, in directory order."""
+        with os.scandir(self.project_dir) as it:
+            return [entry for entry in it
+                    if entry.name.endswith(SESSION_FILE_EXTS) and entry.is_file()]
+
+    def _scan_sessions(self):
+        """Return (filename, path, stat result) for each session file, newest first."""
+        entries = [(entry.name, entry.path, entry.stat()) for entry in self._session_entries()]
+        entries.sort(key=lambda e: (e[2].st_mtime, e[0]), reverse=True)
+        return entries
+
     def list_sessions(self, include_metadata=False):
-        """List saved conversation files with optional metadata."""
-        files = [f for f in os.listdir(self.project_dir) if f.endswith('.json')]
+        """
+        List saved conversation files (most recently modified first) with optional metadata.
+
+        Metadata and previews are cached in the project's summary index and
+        reused while a file's mtime and size are unchanged, so only new or
+        modified sessions are read (by a thread pool when there are several).
+        """
+        self.flush()
+        entries = self._scan_sessions()
         
         if not include_metadata:
-            return sorted(files, reverse=True)
+            return [filename for filename, _, _ in entries]
         
+        index = self._load_summary_index()
+        stamps = {filename: [st.st_mtime_ns, st.st_size] for filename, _, st in entries}
+        stale = [(filepath, st.st_mtime) for filename, filepath, st in entries
+                 if index.get(filename, {}).get('stat') != stamps[filename]]
+        if len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as pool:
+                fresh = list(pool.map(self._try_session_summary, *zip(*stale)))
+        else:
+            fresh = [self._try_session_summary(*args) for args in stale]
+        fresh = dict(zip((filepath for filepath, _ in stale), fresh))
+
+        summaries = {}
         sessions_with_meta = []
-        for filename in files:
-            filepath = os.path.join(self.project_dir, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    meta = data.get('metadata', {})
+        for filename, filepath, _ in entries:
+            if filepath in fresh:
+                summary = fresh[filepath]
+                if summary is None:
                     sessions_with_meta.append({
                         'filename': filename,
-                        'metadata': meta,
-                        'preview': self._get_session_preview(data.get('messages', []))
+                        'metadata': {},
+                        'preview': "Unable to load preview"
                     })
-            except:
-                sessions_with_meta.append({
-                    'filename': filename,
-                    'metadata': {},
-                    'preview': "Unable to load preview"
-                })
+                    continue
+                meta, preview = summary
+            else:
+                meta, preview = index[filename]['metadata'], index[filename]['preview']
+
+            summaries[filename] = {'stat': stamps[filename], 'metadata': meta, 'preview': preview}
+            sessions_with_meta.append({
+                'filename': filename,
+                'metadata': meta,
+                'preview': preview
+            })
+
+        if summaries != index:
+            self._save_summary_index(summaries)
         
-        return sorted(sessions_with_meta, key=lambda x: x['metadata'].get('last_modified', ''), reverse=True)
+        return sessions_with_meta
+
+    def _load_summary_index(self):
+        """Read the project's cached session summaries ({} if missing or unreadable)."""
+        try:
+            with open(os.path.join(self.project_dir, SUMMARY_INDEX_FILE), 'rb') as f:
+                return self._loads_record(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_summary_index(self, summaries):
+        """Atomically replace the project's cached session summaries."""
+        path = os.path.join(self.project_dir, SUMMARY_INDEX_FILE)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(self._dumps_record(summaries))
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            self._print_error(f"Could not update session summaries: {e}")
+
+    @staticmethod
+    def _tail_jsonl(filepath, n, block_size=65536):
+        """Parse the last n records of a JSONL file, reading backwards in blocks."""
+        with open(filepath, 'rb') as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b''
+            # n complete lines need n + 1 newlines (the file ends with one)
+            while pos > 0 and data.count(b'\n') <= n:
+                read_size = min(block_size, pos)
+                pos -= read_size
+                f.seek(pos)
+                data = f.read(read_size) + data
+
+        lines = [line for line in data.splitlines() if line.strip()]
+        return [OllamaChat._loads_record(line) for line in lines[-n:]]
+
+    def _try_session_summary(self, filepath, mtime):
+        """_session_summary(), or None if the file can't be summarized."""
+        try:
+            return self._session_summary(filepath, mtime)
+        except:
+            return None
+
+    def _session_summary(self, filepath, mtime):
+        """Return (metadata, preview) for the session listing."""
+        if filepath.endswith(LEGACY_SESSION_EXT):
+            summary = self._peek_legacy_session(filepath)
+            if summary is not None:
+                return summary
+
+        if filepath.endswith(SESSION_EXT):
+            with open(filepath, 'rb') as f:
+                head = self._loads_record(f.readline() or b'{}')
+
+            last_message = None
+            updates = []
+            for record in reversed(self._tail_jsonl(filepath, 4)):
+                if record.get('type') == 'message':
+                    last_message = record
+                    break
+                if record.get('type') == 'message_update':
+                    updates.append(record)
+
+            if last_message is not None and 'context_ref' not in last_message:
+                for update in reversed(updates):
+                    if update['id'] == last_message['id']:
+                        last_message.update(update)
+
+                metadata = {k: v for k, v in head.items() if k != 'type'}
+                metadata['last_modified'] = datetime.fromtimestamp(mtime).isoformat()
+                metadata['message_count'] = last_message['id']
+                return metadata, self._get_session_preview([last_message])
+
+        # Read directly: list_sessions may call this from worker threads,
+        # and listing shouldn't evict loaded sessions from the parse cache
+        data = self._read_session(filepath)
+        metadata = {k: v for k, v in data.get('metadata', {}).items() if k != 'context_data'}
+        return metadata, self._get_session_preview(data.get('messages', []))
+
+    def _peek_legacy_session(self, filepath):
+        """Summarize a legacy JSON session from the ends of the file, or None."""
+        with open(filepath, 'rb') as f:
+            head = f.read(LEGACY_PEEK_SIZE).decode('utf-8', errors='ignore')
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - LEGACY_PEEK_SIZE))
+            tail = f.read().decode('utf-8', errors='ignore')
+
+        key = LEGACY_MESSAGES_KEY_RE.search(head)
+        if not key:
+            return None
+        try:
+            document = json.loads(head[:key.start()].rstrip().rstrip(',') + '}')
+        except ValueError:
+            return None
+        metadata = document.get('metadata')
+        if not isinstance(metadata, dict) or 'message_count' not in metadata:
+            return None
+        metadata = {k: v for k, v in metadata.items() if k != 'context_data'}
+        if not metadata['message_count']:
+            return metadata, self._get_session_preview([])
+
+        decoder = json.JSONDecoder()
+        start = tail.rfind('{')
+        while start != -1:
+            try:
+                message, end = decoder.raw_decode(tail, start)
+            except ValueError:
+                message, end = None, 0
+            if (isinstance(message, dict) and 'role' in message and 'content' in message
+                    and LEGACY_DOCUMENT_END_RE.match(tail, end)):
+                return metadata, self._get_session_preview([message])
+            start = tail.rfind('{', 0, start)
+        return None
 
     def _get_session_preview(self, messages):
         """Get preview of last message in session."""
@@ -203,35 +980,59 @@ class OllamaChat:
         return f"Last: \"{preview}\""
 
     def load_session(self, filename):
-        """Load conversation with enhanced error handling."""
+        """
+        Load conversation with enhanced error handling.
+
+        If the file is missing, a session of the same name saved in another
+        format is loaded instead, so a legacy .json name still finds its
+        converted .jsonl file.
+        """
+        self.flush()
         self.filepath = os.path.join(self.project_dir, filename)
+        if not os.path.exists(self.filepath):
+            base = os.path.splitext(self.filepath)[0]
+            self.filepath = next((base + ext for ext in SESSION_FILE_EXTS if os.path.exists(base + ext)),
+                                 self.filepath)
         try:
-            with open(self.filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.messages = data.get('messages', [])
-                self.context_data = data.get('metadata', {}).get('context_data', [])
-                
-                metadata = data.get('metadata', {})
-                loaded_model = metadata.get('model', 'N/A')
-                
-                if self.visual_mode != 'silent':
-                    self._print_success(f"Loaded {filename}")
-                    if loaded_model != self.model:
-                        print(f"[Warning] Session used {loaded_model}, now using {self.model}")
-                
-                return True
+            data = self._load_raw(self.filepath)
+            self.messages = data.get('messages', [])
+            self.context_data = data.get('metadata', {}).get('context_data', [])
+            self._context_refs = data.get('context_refs', {})
+            self._ctx_tokens = None
+            self._recount_stats()
+            self._persisted_count = len(self.messages)
+            self._sync_search_index()
+            
+            metadata = data.get('metadata', {})
+            loaded_model = metadata.get('model', 'N/A')
+            self.created_time = metadata.get('created', datetime.now().isoformat())
+            
+            if self.visual_mode != 'silent':
+                self._print_success(f"Loaded {filename}")
+                if loaded_model != self.model:
+                    print(f"[Warning] Session used {loaded_model}, now using {self.model}")
+            
+            return True
         except Exception as e:
             self._print_error(f"Could not load {filename}: {e}")
             self.messages = []
             self.context_data = []
+            self._context_refs = {}
+            self._ctx_tokens = None
+            self._recount_stats()
             self.filepath = None
+            self._persisted_count = 0
             return False
 
     def start_new_session(self, system_prompt=None, session_name=None):
         """Start new session with optional custom name."""
+        self.flush()
         self.filepath = self._generate_filepath(session_name)
         self.messages = []
         self.context_data = []
+        self._context_refs = {}
+        self._ctx_tokens = None
+        self._recount_stats()
         self.created_time = datetime.now().isoformat()
         
         if system_prompt:
@@ -246,35 +1047,88 @@ class OllamaChat:
     # New enhanced methods
 
     def add_context(self, title, content, context_type='text'):
-        """Add context data to the conversation."""
+        """
+        Add context data to the conversation.
+
+        Content already added to this session (compared by hash) is not added
+        again, so repeated contexts are not re-sent to the model every turn.
+        Returns True if the context was added.
+        """
+        content_hash = self._content_hash(content)
+        for item in self.context_data:
+            if (item.get('hash') or self._content_hash(item['content'])) == content_hash:
+                if self.visual_mode != 'silent':
+                    self._print_success(f"Context already present: {item['title']}")
+                return False
+
         context_item = {
             'title': title,
             'content': content,
             'type': context_type,
-            'added_at': datetime.now().isoformat()
+            'added_at': datetime.now().isoformat(),
+            'hash': content_hash
         }
         self.context_data.append(context_item)
         
-        # Add to system context
-        context_msg = f"Context - {title}:\n{content}"
-        self.add_message('system', context_msg, save=True)
+        # Add to system context; the session file references the context record
+        self.add_message('system', self._context_message(context_item), save=False)
+        self._context_refs[len(self.messages) - 1] = content_hash
+        # Written together with the next turn rather than on its own
+        self._persist(extra_records=[{"type": "context", "context": context_item}], defer=True)
         
         if self.visual_mode != 'silent':
             self._print_success(f"Added context: {title}")
+        return True
 
     def add_file_context(self, filepath, title=None):
-        """Add file content as context."""
+        """
+        Add file content as context.
+
+        Files over MAX_CONTEXT_FILE_BYTES, or that look binary, are rejected
+        before being read or decoded. Files over CONTEXT_CHUNK_SIZE characters
+        are added as numbered parts, split at line boundaries.
+        """
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            size = os.stat(filepath).st_size
+            if size > MAX_CONTEXT_FILE_BYTES:
+                self._print_error(f"File {filepath} is too large for context "
+                                  f"({size:,} bytes, limit {MAX_CONTEXT_FILE_BYTES:,})")
+                return False
+
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            if b'\x00' in data[:BINARY_SNIFF_SIZE]:
+                self._print_error(f"File {filepath} looks binary; not added as context")
+                return False
+            # Same newline handling as reading in text mode
+            content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
             
             file_title = title or f"File: {os.path.basename(filepath)}"
-            self.add_context(file_title, content, 'file')
+            chunks = self._split_context(content)
+            if len(chunks) == 1:
+                self.add_context(file_title, content, 'file')
+            else:
+                for number, chunk in enumerate(chunks, 1):
+                    self.add_context(f"{file_title} (part {number}/{len(chunks)})", chunk, 'file')
             return True
         except Exception as e:
             self._print_error(f"Could not read file {filepath}: {e}")
             return False
 
+    @staticmethod
+    def _split_context(content, size=CONTEXT_CHUNK_SIZE):
+        """Split text into pieces of at most size characters, at line ends where possible."""
+        chunks = []
+        start = 0
+        while len(content) - start > size:
+            end = content.rfind('\n', start, start + size) + 1
+            if end <= start:
+                end = start + size  # No line break within the piece
+            chunks.append(content[start:end])
+            start = end
+        chunks.append(content[start:])
+        return chunks
+
     def extract_code_blocks(self, text=None):
         """Extract code blocks from text or last AI response."""
         if text is None:
@@ -282,44 +1136,128 @@ class OllamaChat:
                 return []
             text = self.messages[-1]['content']
         
-        # Find code blocks marked with ```
-        pattern = r'```(\w+)?\n?(.*?)```'
-        matches = re.findall(pattern, text, re.DOTALL)
-        
-        code_blocks = []
-        for lang, code in matches:
-            code_blocks.append({
-                'language': lang.strip() if lang else 'text',
-                'code': code.strip()
-            })
-        
-        return code_blocks
+        if CODE_FENCE not in text:
+            return []
+
+        # Splitting on fences is one linear scan; every odd part is a block
+        # body, and a trailing unclosed fence (last part) is ignored
+        parts = text.split(CODE_FENCE)
+        blocks = []
+        for body in parts[1:-1:2]:
+            language = CODE_LANGUAGE_RE.match(body).group()
+            code = body[len(language):]
+            if code.startswith('\n'):
+                code = code[1:]
+            blocks.append({'language': language or 'text', 'code': code.strip()})
+        return blocks
 
     def get_last_response(self):
         """Get the last AI response."""
-        for msg in reversed(self.messages):
-            if msg['role'] == 'assistant':
-                return msg['content']
-        return None
+        if self._last_assistant_idx is None:
+            return None
+        return self.messages[self._last_assistant_idx]['content']
 
     def search_messages(self, query, role=None):
-        """Search messages for specific content."""
+        """
+        Search messages for specific content.
+
+        Matches are case-insensitive substrings of the message text. Saved
+        messages are looked up in the project's trigram FTS5 index and ranked
+        by BM25 relevance, followed by unsaved ones in order. Queries shorter
+        than MIN_INDEXED_QUERY characters, or a missing index, scan all
+        messages in order instead. The index folds case as SQLite does and
+        the scan uses str.lower(); they agree for ASCII and accented Latin
+        text, but may differ for characters such as 'İ' whose lowercase form
+        is longer.
+        """
+        db = self._get_search_index() if self.filepath and len(query) >= MIN_INDEXED_QUERY else None
+        if not db:
+            return self._scan_messages(query, role)
+
+        # Queued messages are only indexed once written
+        self.flush()
+
+        sql = ("SELECT m.idx FROM chat_messages_fts f JOIN chat_messages m ON m.id = f.rowid "
+               "WHERE chat_messages_fts MATCH ? AND m.session = ?")
+        params = ['"' + query.replace('"', '""') + '"', os.path.basename(self.filepath)]
+        if role:
+            sql += " AND m.role = ?"
+            params.append(role)
+        sql += " ORDER BY bm25(chat_messages_fts)"
+
+        try:
+            with self._flush_lock:
+                indices = [row[0] for row in db.execute(sql, params)]
+        except sqlite3.Error:
+            return self._scan_messages(query, role)
+
+        needle = query.lower()
+        results = [self._search_result(i, self._match_position(i, needle))
+                   for i in indices if i < len(self.messages)]
+        results.extend(self._scan_messages(query, role, start=self._persisted_count))
+        return results
+
+    def _get_search_blob(self):
+        """Return the lowercased, joined message contents and each message's start offset."""
+        blob, offsets = self._search_blob or ('', [])
+        if len(offsets) < len(self.messages):
+            parts = [blob] if offsets else []
+            position = len(blob) + len(SEARCH_SEPARATOR) if offsets else 0
+            for msg in self.messages[len(offsets):]:
+                lowered = msg['content'].lower()
+                offsets.append(position)
+                position += len(lowered) + len(SEARCH_SEPARATOR)
+                parts.append(lowered)
+            blob = SEARCH_SEPARATOR.join(parts)
+            self._search_blob = (blob, offsets)
+        return blob, offsets
+
+    def _scan_messages(self, query, role=None, start=0):
+        """Case-insensitive substring search over in-memory messages from start onwards."""
+        if start >= len(self.messages):
+            return []
+
+        blob, offsets = self._get_search_blob()
+        needle = query.lower()
         results = []
-        for i, msg in enumerate(self.messages):
-            if role and msg['role'] != role:
-                continue
-            if query.lower() in msg['content'].lower():
-                results.append({
-                    'index': i,
-                    'role': msg['role'],
-                    'content': msg['content'],
-                    'snippet': self._get_search_snippet(msg['content'], query)
-                })
+        position = offsets[start]
+        while True:
+            found = blob.find(needle, position)
+            if found == -1:
+                break
+            i = bisect.bisect_right(offsets, found) - 1
+            if not role or self.messages[i]['role'] == role:
+                results.append(self._search_result(i, self._match_position(i, needle, found)))
+            if i + 1 >= len(offsets):
+                break
+            position = offsets[i + 1]
         return results
 
-    def _get_search_snippet(self, text, query, context_chars=100):
-        """Get snippet around search query."""
-        query_pos = text.lower().find(query.lower())
+    def _match_position(self, index, needle, found=None):
+        """Offset of needle in the content of the message at index (-1 if absent)."""
+        blob, offsets = self._get_search_blob()
+        start = offsets[index]
+        end = offsets[index + 1] - len(SEARCH_SEPARATOR) if index + 1 < len(offsets) else len(blob)
+        content = self.messages[index]['content']
+        if end - start != len(content):
+            # Lowercasing changed the length, so blob offsets don't map back
+            return content.lower().find(needle)
+        if found is None:
+            found = blob.find(needle, start, end)
+        return found - start if found != -1 else -1
+
+    def _search_result(self, index, query_pos):
+        """Build a search result entry for the message at index, matched at query_pos."""
+        msg = self.messages[index]
+        return {
+            'index': index,
+            'role': msg['role'],
+            'content': msg['content'],
+            'snippet': self._get_search_snippet(msg['content'], query_pos)
+        }
+
+    def _get_search_snippet(self, text, query_pos, context_chars=100):
+        """Get snippet around the match at query_pos (-1: no exact match)."""
         if query_pos == -1:
             return text[:100] + '...'
         
@@ -336,43 +1274,115 @@ class OllamaChat:
 
     def switch_to_project(self, project_name):
         """Switch to different project context."""
+        self.flush()
+        self._close_search_index()
         self.project_name = project_name
         self._ensure_conversations_dir()
         self.messages = []
         self.context_data = []
+        self._context_refs = {}
+        self._ctx_tokens = None
+        self._recount_stats()
         self.filepath = None
+        self._persisted_count = 0
         
         if self.visual_mode != 'silent':
             self._print_success(f"Switched to project: {project_name}")
 
-    def get_session_stats(self):
-        """Get statistics about current session."""
+    def get_session_stats(self, include_tokens=False):
+        """
+        Get statistics about current session.
+
+        With include_tokens=True a 'total_tokens' count is added (needs the
+        tokenizer, see token_counts()). Messages are tokenized once, in a
+        single batch covering all not yet counted.
+        """
         if not self.messages:
             return {}
         
         stats = {
             'total_messages': len(self.messages),
-            'user_messages': len([m for m in self.messages if m['role'] == 'user']),
-            'assistant_messages': len([m for m in self.messages if m['role'] == 'assistant']),
-            'system_messages': len([m for m in self.messages if m['role'] == 'system']),
-            'total_characters': sum(len(m['content']) for m in self.messages),
+            'user_messages': self._stats['user'],
+            'assistant_messages': self._stats['assistant'],
+            'system_messages': self._stats['system'],
+            'total_characters': self._stats['characters'],
             'context_items': len(self.context_data)
         }
+        if include_tokens:
+            stats['total_tokens'] = self._count_session_tokens()
         
         return stats
 
+    def _count_session_tokens(self):
+        """Total tokens in the history, tokenizing only messages added since the last call."""
+        counted = len(self._msg_token_counts)
+        if counted < len(self.messages):
+            new_counts = self.token_counts([m['content'] for m in self.messages[counted:]])
+            self._msg_token_counts.extend(new_counts)
+            self._stats['tokens'] += sum(new_counts)
+        return self._stats['tokens']
+
+    def _recount_stats(self):
+        """Rebuild the running message counts from self.messages (and drop the search blob)."""
+        self._search_blob = None
+        self._msg_token_counts = []  # Per-message token counts, filled lazily by _count_session_tokens()
+
+        # One pass with local counters; this runs over whole loaded sessions
+        stats = {'user': 0, 'assistant': 0, 'system': 0}
+        characters = 0
+        last_assistant = None
+        for i, message in enumerate(self.messages):
+            message['role'] = role = sys.intern(message['role'])
+            if role in stats:
+                stats[role] += 1
+            if role == 'assistant':
+                last_assistant = i
+            characters += len(message['content'])
+        stats['characters'] = characters
+        stats['tokens'] = 0
+        self._stats = stats
+        self._last_assistant_idx = last_assistant  # See get_last_response()
+
+    def _count_message(self, message, sign=1):
+        """Add a message to (or with sign=-1 remove it from) the running counts."""
+        if message['role'] in self._stats:
+            self._stats[message['role']] += sign
+        self._stats['characters'] += sign * len(message['content'])
+
+    def _append_message(self, message):
+        """Append a message to the history, keeping the running stats current."""
+        message['role'] = sys.intern(message['role'])  # One shared string per role
+        self.messages.append(message)
+        self._count_message(message)
+        if message['role'] == 'assistant':
+            self._last_assistant_idx = len(self.messages) - 1
+
+    def _pop_message(self):
+        """Remove the last message from the history (e.g. after a failed send)."""
+        self._count_message(self.messages.pop(), sign=-1)
+        if len(self._msg_token_counts) > len(self.messages):
+            self._stats['tokens'] -= self._msg_token_counts.pop()
+        if self._last_assistant_idx == len(self.messages):
+            self._last_assistant_idx = next(
+                (i for i in range(len(self.messages) - 1, -1, -1)
+                 if self.messages[i]['role'] == 'assistant'),
+                None
+            )
+        self._search_blob = None
+
     # Enhanced core methods
     
     def add_message(self, role, content, save=True):
         """Add message with validation and formatting."""
-        if role not in ['user', 'assistant', 'system']:
+        if role not in VALID_ROLES:
             self._print_error(f"Invalid role: {role}")
             return False
             
-        self.messages.append({'role': role, 'content': content})
+        self._append_message({'role': role, 'content': content})
+        self._ctx_tokens = None  # Server context no longer matches the history
         
         if save and self.filepath:
-            self._save()
+            self._persist()
         
         return True
 
@@ -386,54 +1396,247 @@ class OllamaChat:
         if stream_output is None:
             stream_output = self.visual_mode in ['rich', 'plain']
 
-        self.messages.append({'role': 'user', 'content': user_input})
+        self._append_message({'role': 'user', 'content': user_input})
         
         if stream_output and self.visual_mode != 'silent':
             self._print_message('user', user_input)
 
-        full_response = ""
-        
+        printer = None
         try:
-            if stream_output and self.console:
-                # Rich streaming with progress
-                with self.console.status("[green]🤖 AI is thinking...", spinner="dots"):
-                    time.sleep(0.5)  # Brief pause for effect
-                
-                self._print_message('assistant', '', stream=True)
-            
-            stream = ollama.chat(
-                model=self.model,
-                messages=self.messages,
-                stream=True,
-            )
+            # The printer is stopped on any exit (including Ctrl-C), and
+            # before an error is reported so it starts on its own line
+            try:
+                if stream_output and self.console:
+                    # Rich streaming with progress
+                    stream = self._spin_until_first_chunk(self._open_stream)
+                else:
+                    stream = self._open_stream()
 
-            for chunk in stream:
-                part = chunk['message']['content']
                 if stream_output and self.visual_mode != 'silent':
-                    if self.console:
-                        self.console.print(part, end='', style="green")
-                    else:
-                        print(part, end='', flush=True)
-                full_response += part
-            
-            if stream_output and self.visual_mode != 'silent':
-                print()  # Newline after streaming
+                    printer = self._start_printer()
+                message = self._accumulate_streaming_response(
+                    stream, on_part=printer[0].put if printer else None
+                )
+            finally:
+                error = self._finish_stream(printer)
+            if error:
+                raise error
+            full_response = message['content']
 
-            self.messages.append({'role': 'assistant', 'content': full_response})
-            self._save()
+            self._append_message(message)
+            # A finished turn is written now, together with any queued
+            # records (e.g. context added before it), rather than on a timer
+            self._persist(defer=True)
+            self.flush()
             return full_response
 
         except ollama.ResponseError as e:
             self._print_error(f"Ollama error: {e.error}")
             if self.messages and self.messages[-1]['role'] == 'user':
-                self.messages.pop()
+                self._pop_message()
             return None
         except Exception as e:
             self._print_error(f"Unexpected error: {e}")
             if self.messages and self.messages[-1]['role'] == 'user':
-                self.messages.pop()
+                self._pop_message()
+            return None
+
+    def _spin_until_first_chunk(self, open_stream):
+        """Yield chunks from open_stream(), showing the thinking spinner until the first arrives."""
+        status = self.console.status("[green]🤖 AI is thinking...", spinner="dots")
+        status.start()
+        try:
+            for chunk in open_stream():
+                if status is not None:
+                    status.stop()
+                    status = None
+                    self._print_message('assistant', '', stream=True)
+                yield chunk
+        finally:
+            if status is not None:
+                status.stop()
+
+    def _open_stream(self, client=None, messages=None):
+        """Start a streaming request answering the last message of messages (default: the history)."""
+        client = client or _get_client()
+        messages = self.messages if messages is None else messages
+        user_input = messages[-1]['content']
+        history = range(len(messages) - 1)
+
+        if self._ctx_tokens is not None:
+            return client.generate(model=self.model, prompt=user_input,
+                                   context=self._ctx_tokens, stream=True)
+        if all(messages[i]['role'] == 'system' for i in history):
+            system = '\n\n'.join(messages[i]['content'] for i in history) or None
+            return client.generate(model=self.model, prompt=user_input,
+                                   system=system, stream=True)
+        return client.chat(model=self.model, messages=messages, stream=True)
+
+    def _accumulate_streaming_response(self, chunks, on_part=None, update_state=True):
+        """Assemble streamed chat or generate chunks into a single assistant message."""
+        parts = []
+        tool_calls = []
+        last_chunk = None
+
+        for chunk in chunks:
+            if chunk is None:
+                continue
+            last_chunk = chunk
+            message = chunk.get('message') or {}
+            part = message.get('content') or chunk.get('response') or ''
+            if message.get('tool_calls'):
+                tool_calls.extend(
+                    call.model_dump() if hasattr(call, 'model_dump') else call
+                    for call in message['tool_calls']
+                )
+            if part:
+                if on_part:
+                    on_part(part)
+                parts.append(part)
+
+        if update_state and last_chunk is not None and last_chunk.get('done'):
+            self.last_usage = {
+                'prompt_tokens': last_chunk.get('prompt_eval_count'),
+                'completion_tokens': last_chunk.get('eval_count')
+            }
+            if last_chunk.get('context'):
+                self._ctx_tokens = last_chunk['context']
+
+        assembled = {'role': 'assistant', 'content': ''.join(parts)}
+        if tool_calls:
+            assembled['tool_calls'] = tool_calls
+        return assembled
+
+    # Async methods
+
+    async def _achat(self, messages, client, update_state=False):
+        """Stream a reply to the last of messages from the async client and return its text."""
+        stream = await self._open_stream(client, messages)
+
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+        return self._accumulate_streaming_response(chunks, update_state=update_state)['content']
+
+    async def _agenerate(self, prompt, client):
+        """Stream a one-off /api/generate reply to prompt and return the full text."""
+        stream = await client.generate(model=self.model, prompt=prompt, stream=True)
+
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+        return self._accumulate_streaming_response(chunks, update_state=False)['content']
+
+    def _replies_or_none(self, results):
+        """Report the exceptions in asyncio.gather results and replace them with None."""
+        replies = []
+        for result in results:
+            if isinstance(result, ollama.ResponseError):
+                self._print_error(f"Ollama error: {result.error}")
+                replies.append(None)
+            elif isinstance(result, Exception):
+                self._print_error(f"Unexpected error: {result}")
+                replies.append(None)
+            else:
+                replies.append(result)
+        return replies
+
+    async def asend(self, user_input, commit=True):
+        """
+        Async send without console streaming, for use with asyncio.
+
+        With commit=False the reply is returned but neither message is added
+        to the history, e.g. for speculative requests that may be discarded;
+        the context tokens carried between turns are left untouched too.
+        """
+        if not self.filepath:
+            self._print_error("No active session. Use start_new_session() first.")
+            return None
+
+        user_message = {'role': 'user', 'content': user_input}
+        history_length = len(self.messages)
+
+        try:
+            async with ollama.AsyncClient(timeout=None, limits=HTTP_LIMITS) as client:
+                full_response = await self._achat((*self.messages, user_message), client,
+                                                  update_state=commit)
+        except ollama.ResponseError as e:
+            self._print_error(f"Ollama error: {e.error}")
+            return None
+        except Exception as e:
+            self._print_error(f"Unexpected error: {e}")
             return None
 
+        if not commit:
+            return full_response
+
+        if len(self.messages) != history_length:
+            # The history changed while waiting; the new context doesn't cover it
+            self._ctx_tokens = None
+        self._append_message(user_message)
+        self._append_message({'role': 'assistant', 'content': full_response})
+        self._persist(defer=True)
+        self.flush()
+        return full_response
+
+    async def send_many(self, prompts):
+        """
+        Send several independent prompts concurrently.
+
+        Each prompt is answered against the current history followed by just
+        that prompt, so replies don't see each other. Completed turns are then
+        recorded in prompt order. Returns replies in the same order (None for
+        failures).
+        """
+        if not self.filepath:
+            self._print_error("No active session. Use start_new_session() first.")
+            return [None] * len(prompts)
+
+        # One immutable snapshot shared by every request (each sees it through
+        # a view rather than its own copy); changes to the history while the
+        # batch is in flight can't leak into it
+        prefix = tuple(self.messages)
+        async with ollama.AsyncClient(timeout=None, limits=HTTP_LIMITS) as client:
+            results = await asyncio.gather(
+                *(self._achat(_HistoryWithPrompt(prefix, {'role': 'user', 'content': prompt}), client)
+                  for prompt in prompts),
+                return_exceptions=True
+            )
+
+        self._ctx_tokens = None
+        responses = self._replies_or_none(results)
+        for prompt, response in zip(prompts, responses):
+            if response is not None:
+                self._append_message({'role': 'user', 'content': prompt})
+                self._append_message({'role': 'assistant', 'content': response})
+
+        self._persist(defer=True)
+        self.flush()
+        return responses
+
+    async def send_batch(self, prompts, token_budget=BATCH_TOKEN_BUDGET):
+        """
+        Answer independent one-off prompts concurrently, without any history.
+
+        Unlike send_many, no session is needed and nothing is recorded: each
+        prompt is streamed from /api/generate on its own. Returns replies in prompt
+        order (None for failures). Prints a warning when the prompts together
+        are estimated to exceed token_budget tokens.
+        """
+        approx_tokens = sum(len(prompt) for prompt in prompts) // CHARS_PER_TOKEN
+        if approx_tokens > token_budget:
+            self._print_warning(
+                f"Batch of {len(prompts)} prompts is ~{approx_tokens} tokens "
+                f"(budget {token_budget}); the server may run out of memory"
+            )
+
+        async with ollama.AsyncClient(timeout=None, limits=HTTP_LIMITS) as client:
+            results = await asyncio.gather(
+                *(self._agenerate(prompt, client) for prompt in prompts),
+                return_exceptions=True
+            )
+        return self._replies_or_none(results)
+
     # Interactive and display methods
     
     def display_session_selector(self):
@@ -450,7 +1653,7 @@ class OllamaChat:
             table.add_row("N", "[bold green]🆕 Start New Chat[/bold green]", "", "")
             
             for i, session in enumerate(sessions[:10], 1):  # Show max 10 recent
-                name = session['filename'].replace('.json', '')
+                name = os.path.splitext(session['filename'])[0]
                 preview = session['preview']
                 modified = session['metadata'].get('last_modified', 'Unknown')
                 if modified != 'Unknown':
@@ -463,7 +1666,7 @@ class OllamaChat:
             print("\n--- Session Selector ---")
             print(" [N] Start New Chat")
             for i, session in enumerate(sessions[:10], 1):
-                name = session['filename'].replace('.json', '')
+                name = os.path.splitext(session['filename'])[0]
                 preview = session['preview']
                 print(f" [{i}] {name}")
                 print(f"     {preview}")
@@ -523,18 +1726,21 @@ class OllamaChat:
             
         recent_messages = self.messages[-limit*2:] if len(self.messages) > limit*2 else self.messages
         
+        previews = [(msg['role'], msg['content'][:100] + '...' if len(msg['content']) > 100 else msg['content'])
+                    for msg in recent_messages]
+        
+        # One print (and one rich layout pass) for the whole block
         if self.console:
-            self.console.print("[dim]--- Recent History ---[/dim]")
-            for msg in recent_messages:
-                content = msg['content'][:100] + '...' if len(msg['content']) > 100 else msg['content']
-                self._print_message(msg['role'], content)
-            self.console.print("[dim]--- End History ---[/dim]\n")
+            self.console.print(Group(
+                "[dim]--- Recent History ---[/dim]",
+                *(self._message_panel(role, content) for role, content in previews),
+                "[dim]--- End History ---[/dim]\n"
+            ))
         else:
-            print("--- Recent History ---")
-            for msg in recent_messages:
-                content = msg['content'][:100] + '...' if len(msg['content']) > 100 else msg['content']
-                print(f"{msg['role'].title()}: {content}")
-            print("--- End History ---\n")
+            lines = ["--- Recent History ---"]
+            lines.extend(f"{ROLE_TITLES.get(role) or role.title()}: {content}" for role, content in previews)
+            lines.append("--- End History ---\n")
+            print('\n'.join(lines))
 
     def _show_help(self):
         """Show available commands."""
@@ -609,42 +1815,48 @@ class OllamaChat:
         """Display conversation history (Jupyter-friendly)."""
         messages_to_show = self.messages[-limit:] if limit else self.messages
         
+        # One print (and one rich layout pass) for the whole history
         if self.console:
-            for msg in messages_to_show:
-                self._print_message(msg['role'], msg['content'])
+            self.console.print(Group(*(self._message_panel(msg['role'], msg['content'])
+                                       for msg in messages_to_show)))
         else:
-            for msg in messages_to_show:
-                print(f"\n{msg['role'].title()}: {msg['content']}")
+            print(''.join(f"\n{ROLE_TITLES.get(msg['role']) or msg['role'].title()}: {msg['content']}\n"
+                          for msg in messages_to_show), end='')
 
-    def to_markdown(self):
-        """Export conversation to markdown format."""
-        markdown_lines = [f"# Chat Session - {self.model}\n"]
+    def _iter_markdown(self):
+        """Yield the markdown export piece by piece."""
+        yield f"# Chat Session - {self.model}\n"
         
         if self.project_name:
-            markdown_lines.append(f"**Project:** {self.project_name}\n")
+            yield f"\n**Project:** {self.project_name}\n"
         
-        markdown_lines.append(f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M')}\n")
+        yield f"\n**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M')}\n"
         
+        # One formatted piece per message; emoji and titles are looked up,
+        # not rebuilt per message
         for msg in self.messages:
-            role_emoji = {'user': '👤', 'assistant': '🤖', 'system': '🔧'}
-            emoji = role_emoji.get(msg['role'], '•')
-            markdown_lines.append(f"\n## {emoji} {msg['role'].title()}\n")
-            markdown_lines.append(f"{msg['content']}\n")
-        
-        return '\n'.join(markdown_lines)
+            role = msg['role']
+            title = ROLE_TITLES.get(role) or role.title()
+            yield f"\n\n## {ROLE_EMOJI.get(role, '•')} {title}\n\n{msg['content']}\n"
+
+    def to_markdown(self):
+        """Export conversation to markdown format."""
+        return ''.join(self._iter_markdown())
+
+    def write_markdown(self, path):
+        """Write the markdown export to a file without building it in memory first."""
+        with open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(self._iter_markdown())
     
     @staticmethod
     def token_counts(text):
-        # Load the DeepSeek-R1 tokenizer
-        tokenizer = AutoTokenizer.from_pretrained("deepseek-ai/DeepSeek-R1")
-
-        # Tokenize the input text
-        tokens = tokenizer.encode(text, add_special_tokens=False)
-
-        # Count the number of tokens
-        token_count = len(tokens)
+        """Count DeepSeek-R1 tokens in a string, or in each string of a list."""
+        if isinstance(text, str):
+            return _count_tokens(text)
 
-        return token_count
+        # One batched call instead of a tokenizer pass per string
+        encoded = _get_tokenizer()(list(text), add_special_tokens=False)
+        return [len(ids) for ids in encoded['input_ids']]
 
 # Main application (enhanced)
 def main():